@@ -18,4 +18,4 @@ Main Features
 
 
 from hyq.model import GWModel
-from hyq.wells import well
\ No newline at end of file
+from hyq.wells import well, WellField
\ No newline at end of file
@@ -1,21 +1,28 @@
 import math
 from pathlib import Path
-import os
-import tempfile
 
 import numpy as np
 import matplotlib.pyplot as plt
 import rasterio
-from rasterio.plot import show
+from rasterio.crs import CRS
+from rasterio.plot import show, plotting_extent
 
 from osgeo import osr
 from osgeo import ogr
 from osgeo import gdal
+from osgeo import gdal_array
 
 import hyq.wells
-from hyq.wells import well
+from hyq.wells import well, WellField
 from hyq.theis import theis_drawdown, jakob_freegw_mod
-from hyq.model_backend import calculate_well_dist_mat, calculate_well_drawdown, raster_from_scratch
+from hyq.model_backend import (
+    calculate_well_distsq_mat, calculate_u_prefactor, calculate_heads, raster_from_scratch, timestep_chunksize
+)
+
+try:
+    import joblib
+except ImportError:
+    joblib = None
 
 class GWModel:
     '''Simulate the impact of pumping groundwater from an aquifer on its head
@@ -28,18 +35,31 @@ class GWModel:
         grid: A dict containing the spatial discretisation of the model. Set up by set_grid method.
         aquifer: A dict containing aquifer parameters. Set up by set_aquiferparams method.
         wells: A list of pumping wells. Set up by add_wells method.
+        wellfield: The same wells as a hyq.wells.WellField (struct of arrays). Set up by add_wells method.
+        distsq_stack: A numpy array (well, row, col) of each wells squared distance to every grid cell. Set up by
+            add_wells. The plain distances are available as the dist_stack property.
         timesteps: A list of points in time [seconds since pumping started] to model. Set up by set_timesteps method.
         H: A list of numpy arrays giving the aquifer head at the designated timesteps. Model result.
+        drawdown: A numpy array (well, row, col) of each wells drawdown at the last timestep. Set up by run method.
+        dtype: The numpy floating point type of all model grids, float32 unless chosen otherwise.
 
     '''
-    def __init__(self):
+    def __init__(self, dtype = np.float32):
         '''Initialize the new model
+
+        Args:
+            dtype: Floating point precision of the model grids. Defaults to np.float32, which is plenty for heads
+                and drawdowns and halves the memory of every grid. Pass np.float64 for full double precision.
         '''
+        self.dtype = np.dtype(dtype)
         self.grid = {}
         self.aquifer = {}
         self.wells = []
+        self.wellfield = WellField()
+        self.distsq_stack = None
         self.timesteps = []
         self.H = []
+        self.drawdown = None
 
     def set_grid(
             self, x_min: float, y_max: float, len_x: float, len_y: float, res_x: float, res_y: float, crs = None
@@ -66,14 +86,20 @@ class GWModel:
             x_min=x_min, y_max=y_max, len_x=len_x, len_y=len_y, res_x=res_x, res_y=res_y
         )
 
-        self.grid["origindist"] = np.zeros(shape = self.grid["arrayshape"])
-        with np.nditer(self.grid["origindist"], flags=['multi_index'], op_flags=['readwrite']) as it:
-            for cell in it:
-                i, j = it.multi_index
-                x = j * res_x
-                y = i * res_y
-                #print(f'j = {j}, x = {x} and i = {i}, y = {y}')
-                cell[...] = math.dist([0, 0], [x, y])
+        # no wells yet: an empty stack, so a model run without wells simply keeps H0
+        self.distsq_stack = np.empty((0, *self.grid["arrayshape"]), dtype=self.dtype)
+
+    @property
+    def origindist(self) -> np.array:
+        '''Distance of every grid cell from the grid origin (the upper left cell) [m]
+
+        Not needed to run the model, so it is only computed when asked for.
+        '''
+        nrow, ncol = self.grid["arrayshape"]
+        x = np.arange(ncol, dtype=self.dtype)[None, :] * self.grid["description"]["res_x"]
+        y = np.arange(nrow, dtype=self.dtype)[:, None] * self.grid["description"]["res_y"]
+
+        return np.hypot(x, y)
 
     def set_aquiferparams(self, H0: float, T: float, S: float, M: float, confined: bool) -> None:
         '''Define the model aquifer
@@ -88,28 +114,28 @@ class GWModel:
             M: Thickness of the aquifer [m]
             confined: whether the aquifer is confined
         '''
-        self.grid["H0"] = np.full(shape = self.grid["arrayshape"], fill_value=H0)
+        self.grid["H0"] = np.full(shape = self.grid["arrayshape"], fill_value=H0, dtype=self.dtype)
         self.aquifer["T"] = T
         self.aquifer["S"] = S
         self.aquifer["M"] = M
         self.aquifer["confined"] = confined
 
+    @property
+    def dist_stack(self) -> np.array:
+        '''Distance (well, row, col) of every well to every grid cell [m]
+
+        Not needed to run the model (which works on distsq_stack), so it is only computed when asked for.
+        '''
+        return np.sqrt(self.distsq_stack)
+
     def __calculate_well_dist_mat(self):
-        res_x = self.grid["description"]["res_x"]
-        res_y = self.grid["description"]["res_y"]
-        x_min = self.grid["description"]["x_min"]
-        y_max = self.grid["description"]["y_max"]
-
-
-        for well in self.wells:
-            well.distmat = calculate_well_dist_mat(
-                well = well,
-                shape = self.grid["origindist"].shape,
-                res_x = res_x,
-                res_y = res_y,
-                x_min = x_min,
-                y_max = y_max
-            )
+        # squared distances only depend on geometry, so they are computed once instead of per timestep
+        gd = self.grid["description"]
+        self.distsq_stack = calculate_well_distsq_mat(
+            wells_x = self.wellfield.xs, wells_y = self.wellfield.ys,
+            x_min = gd["x_min"], y_max = gd["y_max"], res_x = gd["res_x"], res_y = gd["res_y"],
+            shape = self.grid["arrayshape"], dtype = self.dtype
+        )
 
     def add_wells(self, *args: hyq.wells.well) -> None:
         '''Add pumping wells to the model that extract water from the aquifer
@@ -117,9 +143,12 @@ class GWModel:
         Args:
             *args: A well class object as defined by hyq.wells.well
         '''
-        for arg in args:
-            if isinstance(arg, hyq.wells.well):
-                self.wells.append(arg)
+        new_wells = [arg for arg in args if isinstance(arg, hyq.wells.well)]
+        self.wells.extend(new_wells)
+
+        # wells are also kept as struct of arrays, which is what the calculations work on
+        self.wellfield.add(*new_wells)
+
         self.__calculate_well_dist_mat()
 
     def set_timesteps(self, tlist: list) -> None:
@@ -129,37 +158,103 @@ class GWModel:
 
         Args:
             tlist: A list with integers that are times in seconds since pumping started.
+
+        Raises:
+            ValueError: if any of the times is not positive. Theis' solution is only defined after pumping started.
         '''
+        if np.any(np.asarray(tlist) <= 0):
+            raise ValueError("All timesteps must be positive times in seconds since pumping started")
         self.timesteps = tlist
 
-    def run(self):
+    def run(self, n_jobs: int = 1):
         '''Actually run the model calculations
+
+        Timesteps are calculated in chunks, all wells and all timesteps of a chunk in one go. Timesteps are independent
+        of each other, so for models with many of them the chunks can be spread over several processes. This requires
+        the optional dependency joblib.
+
+        Args:
+            n_jobs: Number of processes to calculate timesteps in. Defaults to 1, -1 uses all cores.
+                Only with n_jobs = 1 the drawdown attribute is set.
         '''
         H0 = self.grid["H0"]
-        for t in self.timesteps:
-            H = H0
-            for well in self.wells:
-                sgrid = calculate_well_drawdown(
-                    H0 = H0, t = t, well = well, aquiferparams = self.aquifer
-                )
-                well.drawdown = sgrid
-                H = H - sgrid
-            self.H.append(H)
+        u_prefactor = calculate_u_prefactor(distmat_sq = self.distsq_stack, aquiferparams = self.aquifer)
+        Q = self.wellfield.Qs.astype(self.dtype)[:, None, None]
+
+        chunksize = timestep_chunksize(u_prefactor)
+
+        if n_jobs != 1:
+            if joblib is None:
+                raise ImportError("Running timesteps in parallel requires joblib: pip install joblib")
+
+            chunksize = max(1, min(chunksize, math.ceil(len(self.timesteps) / joblib.effective_n_jobs(n_jobs))))
+            chunks = [self.timesteps[i:i + chunksize] for i in range(0, len(self.timesteps), chunksize)]
+
+            results = joblib.Parallel(n_jobs=n_jobs, backend="loky")(
+                joblib.delayed(calculate_heads)(
+                    H0 = H0, t = tchunk, u_prefactor = u_prefactor, Q = Q, aquiferparams = self.aquifer
+                ) for tchunk in chunks
+            )
+            for Hs in results:
+                self.H.extend(Hs)
+            # the per well drawdowns stay in the worker processes, so none from an earlier run may be left behind
+            self.drawdown = None
+            return
+
+        # one (time, well, row, col) drawdown buffer for all chunks, per chunk only the resulting heads are allocated
+        chunks = [self.timesteps[i:i + chunksize] for i in range(0, len(self.timesteps), chunksize)]
+        s_buf = np.empty((min(chunksize, len(self.timesteps)), *u_prefactor.shape), dtype=self.dtype)
+
+        for tchunk in chunks:
+            Hs = calculate_heads(
+                H0 = H0, t = tchunk, u_prefactor = u_prefactor, Q = Q, aquiferparams = self.aquifer,
+                out = s_buf[:len(tchunk)]
+            )
+            self.H.extend(Hs)
+
+        if len(self.timesteps):
+            # a copy, a view would keep the whole drawdown buffer alive
+            self.drawdown = s_buf[len(chunks[-1]) - 1].copy()
+
+    def __well_index(self, ID: str) -> int:
+        try:
+            return self.wellfield.IDs.index(ID)
+        except ValueError:
+            raise KeyError(f"No well with ID {ID!r} in the model") from None
+
+    def well_distance(self, ID: str) -> np.array:
+        '''Distance of every grid cell from one of the models wells [m]
+
+        Args:
+            ID: The ID of the well, as given to hyq.wells.well
+        '''
+        return np.sqrt(self.distsq_stack[self.__well_index(ID)])
+
+    def well_drawdown(self, ID: str) -> np.array:
+        '''Drawdown [m] of every grid cell caused by one of the models wells at the last timestep
+
+        Args:
+            ID: The ID of the well, as given to hyq.wells.well
+        '''
+        if self.drawdown is None:
+            raise ValueError("No drawdown available: run the model (with n_jobs = 1) first")
+        return self.drawdown[self.__well_index(ID)]
 
     def plot(self):
         '''Simple plotting utility to visually inspect the results of a model run
         '''
         fig, axs = plt.subplots(len(self.H))
+        extent = plotting_extent(self.H[0], self.grid["affine"])
 
         for i, subax in enumerate(axs):
             show(
                 self.H[i], transform = self.grid["affine"], ax = subax, title = f'H at t = {self.timesteps[i]}'
             )
-            show(
-                self.H[i], transform = self.grid["affine"], ax = subax,
-                contour=True,
-                colors='black'
+            # overlay labelled contours on the same axes directly instead of a second pass through show
+            C = subax.contour(
+                self.H[i], extent = extent, origin = 'upper', colors = 'black', linewidths = 1.5, alpha = 0.8
             )
+            subax.clabel(C, fontsize = 8, inline = True)
         plt.show()
 
     def export_head(self, fp: str) -> None:
@@ -176,8 +271,8 @@ class GWModel:
                 fp, "w", driver = 'GTiff',
                 height = self.grid["arrayshape"][0], width = self.grid["arrayshape"][1], crs = self.grid["crs"],
                 count = len(self.H), dtype = self.H[0].dtype, transform = self.grid["affine"]) as dest:
-            for i, H in enumerate(self.H):
-                dest.write(H, i+1)
+            # all bands in one (band, row, col) write
+            dest.write(np.stack(self.H, axis=0))
 
     def export_contours_head(self, gpkgpath: str, levels: list) -> None:
         '''Export contours for the modeled aquifer heads as Vector Geodata
@@ -189,28 +284,27 @@ class GWModel:
             gpkgpath: Output filepath. Should end with .gpkg, e.g.: "path/to/my.gpkg"
             levels: list of floats that give the levels at which contours should be calculated.
         '''
-        fd, path = tempfile.mkstemp(suffix=".tiff")
+        nrow, ncol = self.grid["arrayshape"]
 
-        try:
-            self.export_head(path)
+        # hand the heads to GDAL as an in-memory raster instead of a round trip through a temporary GeoTiff
+        rasterDs = gdal.GetDriverByName("MEM").Create(
+            "", ncol, nrow, len(self.H), gdal_array.NumericTypeCodeToGDALTypeCode(self.H[0].dtype)
+        )
+        rasterDs.SetGeoTransform(self.grid["affine"].to_gdal())
+        if self.grid["crs"] is not None:
+            rasterDs.SetProjection(CRS.from_user_input(self.grid["crs"]).to_wkt())
+        proj = osr.SpatialReference(wkt=rasterDs.GetProjection())
 
-            contourDs = ogr.GetDriverByName("GPKG").CreateDataSource(gpkgpath)
+        # define not a number
+        demNan = -9999
 
+        contourDs = ogr.GetDriverByName("GPKG").CreateDataSource(gpkgpath)
+
+        try:
             for i, H in enumerate(self.H):
-                # Open tif file as select band
-                rasterDs = gdal.Open(path)
+                # write head to its band
                 rasterBand = rasterDs.GetRasterBand(i+1)
-                proj = osr.SpatialReference(wkt=rasterDs.GetProjection())
-
-                # Get elevation as numpy array
-                elevArray = rasterBand.ReadAsArray()
-
-                # define not a number
-                demNan = -9999
-
-                # get dem max and min
-                demMax = elevArray.max()
-                demMin = elevArray[elevArray != demNan].min()
+                rasterBand.WriteArray(H)
 
                 # define layer name and spatial
                 contourShp = contourDs.CreateLayer(f"cntr_{i+1}", proj)
@@ -227,4 +321,4 @@ class GWModel:
 
         finally:
             contourDs.Destroy()
-            os.remove(path)
+            rasterDs = None
@@ -3,8 +3,21 @@ import math
 import numpy as np
 import rasterio
 
-import hyq.wells
-from hyq.theis import theis_drawdown, jakob_freegw_mod
+from hyq.theis import theis_wellfunction_arr, _wellfunction_approx_source
+
+try:
+    from hyq.theis_numba import theis_cell
+except ImportError:
+    theis_cell = None
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+# Theis drawdown as one fused numexpr expression. W(u) = E1(u) is inlined as the polynomial approximation
+# Abramowitz & Stegun 5.1.53 for u < 1 and the rational approximation 5.1.56 for u >= 1
+_DRAWDOWN_EXPR = "C1 * where(u < 1, {0}, {1})".format(*_wellfunction_approx_source("u"))
 
 def raster_from_scratch(x_min: float, y_max: float, len_x: float, len_y: float, res_x: float, res_y: float):
     new_griddescription = {
@@ -22,38 +35,69 @@ def raster_from_scratch(x_min: float, y_max: float, len_x: float, len_y: float,
 
     return (new_griddescription, new_arrayshape, new_transform)
 
-def calculate_well_dist_mat(
-        well: hyq.wells.well, shape: tuple, res_x: float, res_y: float, x_min: float, y_max: float) -> np.array:
-
-    welldistmat = np.zeros(shape=shape)
-
-    with np.nditer(welldistmat, flags=['multi_index'], op_flags=['readwrite']) as it:
-        for cell in it:
-            i, j = it.multi_index
-            x = x_min + (j * res_x)
-            y = y_max - (i * res_y)
-            cell[...] = math.dist([well.x, well.y], [x, y])
-
-    return welldistmat
-
-def calculate_well_drawdown(H0: np.array, t: int, well: hyq.wells.well, aquiferparams: dict) -> np.array:
-    sgrid = np.zeros(shape=H0.shape)
-    with np.nditer(sgrid, flags=['multi_index'], op_flags=['readwrite']) as it:
-        for cell in it:
-            i, j = it.multi_index
-            s = theis_drawdown(
-                    Q=well.Q,
-                    T=aquiferparams["T"],
-                    r=well.distmat[i, j],
-                    S=aquiferparams["S"],
-                    t=t
-                )
-
-            if aquiferparams["confined"]:
-                s_final = s
-            else:
-                s_final = jakob_freegw_mod(s = s, H = H0[i, j])
-
-            cell[...] = s_final
-
-    return sgrid
+def calculate_well_distsq_mat(
+        wells_x: np.array, wells_y: np.array, x_min: float, y_max: float, res_x: float, res_y: float, shape: tuple,
+        dtype = np.float64
+) -> np.array:
+    # squared distances (well, row, col) of all wells to all cells, broadcast from the 1-D column and row offsets,
+    # so no grid of cell coordinates is ever built. The offsets are taken in float64 (real world eastings/northings
+    # would lose precision), only their squares are cast to dtype, the grid sized sum is done in dtype directly
+    nrow, ncol = shape
+    dx2 = np.square((x_min + np.arange(ncol) * res_x)[None, :] - np.asarray(wells_x)[:, None]).astype(dtype)
+    dy2 = np.square((y_max - np.arange(nrow) * res_y)[None, :] - np.asarray(wells_y)[:, None]).astype(dtype)
+
+    return np.add(dy2[:, :, None], dx2[:, None, :])
+
+def calculate_u_prefactor(distmat_sq: np.array, aquiferparams: dict) -> np.array:
+    # the time independent part r²·S/(4·T) of the Theis-Parameter u, a well sitting right on a cell counts as r = 0.01
+    r2 = np.where(distmat_sq > 0, distmat_sq, 0.01**2)
+
+    return r2 * (aquiferparams["S"] / (4 * aquiferparams["T"]))
+
+def calculate_well_drawdown(
+        H0: np.array, t, u_prefactor: np.array, Q, aquiferparams: dict, out: np.array = None) -> np.array:
+    # u_prefactor may be a single wells grid or a (well, row, col) stack, Q then broadcasts as (well, 1, 1)
+    # and t may be a (time, 1, 1, 1) array to get all timesteps at once
+    T = aquiferparams["T"]
+
+    if theis_cell is not None:
+        return theis_cell(u_prefactor, Q, T, t, aquiferparams["confined"], H0, out=out)
+
+    if out is None:
+        out = np.empty(np.broadcast_shapes(np.shape(u_prefactor), np.shape(t)), dtype=u_prefactor.dtype)
+
+    # u is computed once into out, every following pass then works in place
+    np.divide(u_prefactor, t, out=out)
+
+    if numexpr is not None:
+        numexpr.evaluate(
+            _DRAWDOWN_EXPR, local_dict={"u": out, "C1": Q / (4 * math.pi * T)}, out=out, casting="same_kind"
+        )
+        if not aquiferparams["confined"]:
+            numexpr.evaluate("s - s*s/(2*H0)", local_dict={"s": out, "H0": H0}, out=out, casting="same_kind")
+        return out
+
+    theis_wellfunction_arr(out, out=out)
+    np.multiply(out, Q / (4 * math.pi * T), out=out)
+
+    if not aquiferparams["confined"]:
+        out -= np.square(out) / (2 * H0)
+
+    return out
+
+def timestep_chunksize(u_prefactor: np.array, max_elements: int = 2**25) -> int:
+    # number of timesteps whose (time, well, row, col) drawdown tensor stays below max_elements (128 MiB in float32)
+    return max(1, max_elements // max(1, u_prefactor.size))
+
+def calculate_heads(
+        H0: np.array, t: list, u_prefactor: np.array, Q: np.array, aquiferparams: dict, out: np.array = None
+) -> np.array:
+    # heads (time, row, col) for several timesteps and a (well, row, col) stack of wells, evaluated as one
+    # (time, well, row, col) drawdown tensor. out is that tensor and may be reused between calls
+    t = np.asarray(t, dtype=u_prefactor.dtype).reshape(-1, 1, 1, 1)
+    out = calculate_well_drawdown(H0=H0, t=t, u_prefactor=u_prefactor, Q=Q, aquiferparams=aquiferparams, out=out)
+
+    H = out.sum(axis=1)
+    np.subtract(H0, H, out=H)
+
+    return H
@@ -1,5 +1,82 @@
+import functools
 import math
 
+import numpy as np
+from scipy.special import exp1
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+try:
+    from numba import njit
+    _JIT = True
+except ImportError:
+    _JIT = False
+    # numba is optional, without it the scalar kernels below simply stay plain python functions
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+_INV_4PI = 1.0/(4.0*math.pi)
+_GAMMA = float(np.euler_gamma)
+
+# Abramowitz & Stegun 5.1.56: rational approximation of u*exp(u)*W(u) for u >= 1 with |error| < 2e-8,
+# u*exp(u)*W(u) = (u^4 + a1*u^3 + a2*u^2 + a3*u + a4) / (u^4 + b1*u^3 + b2*u^2 + b3*u + b4)
+_W_LARGE_U_NUM = (8.5733287401, 18.0590169730, 8.6347608925, 0.2677737343)
+_W_LARGE_U_DEN = (9.5733223454, 25.6329561486, 21.0996530827, 3.9584969228)
+
+# Abramowitz & Stegun 5.1.53: polynomial approximation for 0 < u < 1 with |error| < 2e-7,
+# W(u) = -ln(u) + a0 + a1*u + a2*u^2 + a3*u^3 + a4*u^4 + a5*u^5. Only used by the backends that cannot call scipy
+_W_SMALL_U = (-0.57721566, 0.99999193, -0.24991055, 0.05519968, -0.00976004, 0.00107857)
+
+# 1/x! for the series terms, looked up instead of being rebuilt on every call. The tuple feeds the code generation
+# below, the array is what compiled code indexes (numba freezes it as a constant, a plain load per term)
+_INV_FACT: tuple[float, ...] = tuple(1.0/math.factorial(x) for x in range(64))
+_INV_FACT_ARR = np.array(_INV_FACT, dtype=np.float64)
+
+def _specialize_series(n: int):
+    '''
+    Generate the Theis-wellfunction series (for u < 1) of a fixed length n as straight-line code: a single unrolled
+    Horner polynomial with its coefficients baked in as literals, numba-compiled when numba is available.
+
+    :param n: Length of the polynomial
+    :return: a function u -> W(u)
+    '''
+    horner = "0.0"
+    for x in range(n + 1, 1, -1):
+        horner = f"{(1.0 if x % 2 else -1.0)*_INV_FACT[x]/x!r} + u*({horner})"
+
+    namespace = {"math": math, "_GAMMA": _GAMMA}
+    exec(f"def _W{n}(u):\n    return -_GAMMA - math.log(u) + u + u*u*({horner})\n", namespace)
+
+    return njit(fastmath=True)(namespace[f"_W{n}"])
+
+# the default series length, specialized once at import
+_W30 = _specialize_series(30)
+
+def _wellfunction_approx_source(u: str) -> tuple[str, str]:
+    '''
+    Source text of the Abramowitz & Stegun approximations of W(u) for backends that compile expressions from strings
+    (numexpr, CUDA kernels). Both only use arithmetic, log and exp, which read the same in either language.
+
+    :param u: expression (e.g. a variable name) of the Theis-Parameter, inserted as is
+    :return: the expressions for u < 1 (5.1.53) and for u >= 1 (5.1.56)
+    '''
+    small = "{1!r} - log({0}) + {0}*({2!r} + {0}*({3!r} + {0}*({4!r} + {0}*({5!r} + {0}*{6!r}))))".format(
+        u, *_W_SMALL_U
+    )
+    large = (
+        "({0}*({0}*({0}*({0} + {1!r}) + {2!r}) + {3!r}) + {4!r})".format(u, *_W_LARGE_U_NUM)
+        + " / ({0}*({0}*({0}*({0} + {1!r}) + {2!r}) + {3!r}) + {4!r})".format(u, *_W_LARGE_U_DEN)
+        + " * exp(-{0}) / {0}".format(u)
+    )
+
+    return small, large
+
+@njit(cache=True, fastmath=True)
 def theis_u(r: float, S: float, T: float, t: float) -> float:
     '''
     Helper-function to calculate the Theis-Parameter u for use with Theis-Wellfunction.
@@ -11,29 +88,122 @@ def theis_u(r: float, S: float, T: float, t: float) -> float:
     :return: Theis-Parameter u
     '''
     r = r if r > 0 else 0.01
-    return (r**2*S)/(4*T*t)
+    return (r*r*S)/(4.0*T*t)
 
+@njit(cache=True, fastmath=True)
 def theis_wellfunction(u: float, n: int = 30) -> float:
     '''
     Helper-function to solve the Theis-wellfunction for use in drawdown calculations
 
     :param u: Theis-Parameter as calculated by theis_u
-    :param n: Length of the polynomial to be solved. Defaults to 30
+    :param n: Length of the polynomial to be solved for u < 1. Defaults to 30
     :return: a solution for the Theis-Wellfunction, often denoted W(u) in literatur
     '''
-    baseterm = -0.5772 - math.log(u) + u
+    if u >= 1:
+        # the series loses all precision for large u, a rational approximation is used there instead
+        num = (((u + _W_LARGE_U_NUM[0])*u + _W_LARGE_U_NUM[1])*u + _W_LARGE_U_NUM[2])*u + _W_LARGE_U_NUM[3]
+        den = (((u + _W_LARGE_U_DEN[0])*u + _W_LARGE_U_DEN[1])*u + _W_LARGE_U_DEN[2])*u + _W_LARGE_U_DEN[3]
+        return (num/den)*math.exp(-u)/u
 
-    for i in range(n):
-        x = 2 + i
+    if _JIT and n == 30:
+        # compiled, the unrolled branch free polynomial beats the early exit loop below
+        return _W30(u)
 
-        if (x % 2) == 0:
-            # even
-            baseterm -= (u**x)/(x*math.factorial(x))
-        else:
-            baseterm += (u**x)/(x*math.factorial(x))
+    # the series terms for x = 2 ... n+1 are (-1)^(x+1) * u^x / (x * x!). For u < 1 they shrink fast, so the sum
+    # stops as soon as a term no longer changes the result at double precision; n is only an upper bound
+    baseterm = -_GAMMA - math.log(u) + u
+    u_pow = u
+    inv_fact = 1.0
+    sign = -1.0
+
+    for x in range(2, n + 2):
+        u_pow *= u
+        inv_fact = _INV_FACT_ARR[x] if x < _INV_FACT_ARR.shape[0] else inv_fact/x
+        term = u_pow*inv_fact/x
+        baseterm += sign*term
+        if term < 1e-15*abs(baseterm):
+            break
+        sign = -sign
 
     return baseterm
 
+@functools.lru_cache(maxsize=100_000)
+def theis_wellfunction_cached(u: float, n: int = 30) -> float:
+    '''
+    Memoized theis_wellfunction for python level callers that evaluate the same u over and over,
+    e.g. superposing wells or replaying timesteps on a fixed set of observation points.
+
+    :param u: Theis-Parameter as calculated by theis_u
+    :param n: Length of the polynomial to be solved for u < 1. Defaults to 30
+    :return: a solution for the Theis-Wellfunction, often denoted W(u) in literatur
+    '''
+    return theis_wellfunction(u, n)
+
+def _float_dtype(a) -> np.dtype:
+    # array functions keep float32 input at float32 (relative error ~1e-6, about twice the throughput), all else
+    # is computed in float64
+    return np.dtype(np.float32) if np.asarray(a).dtype == np.float32 else np.dtype(np.float64)
+
+def theis_u_arr(r: np.ndarray, S: float, T: float, t) -> np.ndarray:
+    '''
+    Vectorized version of theis_u that calculates the Theis-Parameter u for whole numpy arrays of distances
+    (and optionally times), following numpy broadcasting rules.
+
+    :param r: numpy array (or float, or list) of distances from pumping well in [m]
+    :param S: storativity of the aquifer [-]
+    :param T: transmissivity of the aquifer [m²/s]
+    :param t: time since pumping began [s], either a float or a numpy array broadcastable against r
+    :return: numpy array of Theis-Parameters u, float32 if r is float32 and float64 otherwise
+    '''
+    dtype = _float_dtype(r)
+    r = np.asarray(r, dtype=dtype)
+    t = np.asarray(t, dtype=dtype)
+
+    if numexpr is not None:
+        # clamp, square and scale in a single pass over r instead of one temporary array per operation,
+        # the constants are cast to the precision of r so float32 input is not promoted to float64
+        return numexpr.evaluate(
+            "where(r > 0, r*r, r2_min) * c / t",
+            local_dict={"r": r, "r2_min": dtype.type(0.01**2), "c": dtype.type(S/(4*T)), "t": t}
+        )
+
+    r = np.where(r > 0, r, 0.01)
+    # numpy returns scalars for 0-d input, u is always handed back as an array so it can be written to in place
+    return np.asarray((r*r*S)/(4*T*t))
+
+def theis_wellfunction_arr(u: np.ndarray, n: int = 30, out: np.ndarray = None) -> np.ndarray:
+    '''
+    Vectorized version of theis_wellfunction that solves the Theis-wellfunction for a whole array of u at once.
+    W(u) is the exponential integral E1(u), which is evaluated via scipy to full accuracy over the whole range of u,
+    including the large u (u > 1) for which the truncated series of theis_wellfunction breaks down.
+
+    :param u: numpy array of Theis-Parameters as calculated by theis_u_arr
+    :param n: Ignored, only kept for call-compatibility with theis_wellfunction
+    :param out: Optional numpy array (may be u itself) to write the result into instead of allocating a new one
+    :return: numpy array of solutions for the Theis-Wellfunction W(u), same shape as u
+    '''
+    return exp1(u, out=out)
+
+def theis_drawdown_arr(Q: float, T: float, r: np.ndarray, S: float, t, n: int = 30) -> np.ndarray:
+    '''
+    Vectorized version of theis_drawdown that calculates the drawdown within a CONFINED aquifer for whole
+    numpy arrays of distances (and optionally times), e.g. a drawdown map over a model grid.
+
+    :param Q: pumping rate of the well [m³/s]
+    :param T: transmissivity of the aquifer [m²/s]
+    :param r: numpy array of (observation) distances from pumping well in [m]
+    :param S: storativity of the aquifer [-]
+    :param t: time since pumping began [s], either a float or a numpy array broadcastable against r
+    :param n: Ignored, only kept for call-compatibility with theis_drawdown
+    :return: numpy array of drawdowns s [m], float32 if r is float32 and float64 otherwise
+    '''
+    u = theis_u_arr(r = r, S = S, T = T, t = t)
+    W_von_u = theis_wellfunction_arr(u = u, out = u)
+    W_von_u *= Q*_INV_4PI/T
+
+    return W_von_u
+
+@njit(cache=True, fastmath=True)
 def theis_drawdown(Q: float, T: float, r: float, S: float, t: float, n: int = 30) -> float:
     '''
     Calculate the drawdown of the hydraulc potential within a CONFINED aquifer caused by a pumping well
@@ -47,11 +217,70 @@ def theis_drawdown(Q: float, T: float, r: float, S: float, t: float, n: int = 30
     :param n: Length of the polynomial to be solved. Defaults to 30
     :return: drawdown s [m] for t at r
     '''
-    u = theis_u(r = r, S = S, T = T, t = t)
-    W_von_u = theis_wellfunction(u = u, n = n)
+    u = theis_u(r, S, T, t)
+    W_von_u = theis_wellfunction(u, n)
+
+    return (Q*_INV_4PI/T)*W_von_u
+
+def theis_drawdown_unconfined_arr(Q: float, T: float, r: np.ndarray, S: float, t, H, n: int = 30) -> np.ndarray:
+    '''
+    Vectorized drawdown within an UNCONFINED aquifer: theis_drawdown_arr with the correction of jakob_freegw_mod
+    applied directly, without a separate pass for the squared drawdown.
+
+    :param Q: pumping rate of the well [m³/s]
+    :param T: transmissivity of the aquifer [m²/s]
+    :param r: numpy array of (observation) distances from pumping well in [m]
+    :param S: storativity of the aquifer [-]
+    :param t: time since pumping began [s], either a float or a numpy array broadcastable against r
+    :param H: height of the groundwater surface measured from the base of the aquifer [m], float or numpy array
+    :param n: Ignored, only kept for call-compatibility with theis_drawdown
+    :return: numpy array of drawdowns [m] within an unconfined aquifer
+    '''
+    s = theis_drawdown_arr(Q = Q, T = T, r = r, S = S, t = t)
+    H = np.asarray(H, dtype=s.dtype)
+
+    if numexpr is not None:
+        # the constant is passed in the precision of s, a float64 literal would promote float32 input to float64
+        return numexpr.evaluate("s - s*s*(half/H)", local_dict={"s": s, "H": H, "half": s.dtype.type(0.5)})
+    return s - s*s*(0.5/H)
+
+def drawdown_superpose(wellfield, x_grid: np.ndarray, y_grid: np.ndarray, t, S: float, T: float) -> np.ndarray:
+    '''
+    Total drawdown within a CONFINED aquifer caused by a whole field of pumping wells, superposed over
+    a grid of observation points. Each well is handled in a single vectorized pass over the grid.
+
+    :param wellfield: the pumping wells, as hyq.wells.WellField (or anything with xs, ys and Qs arrays)
+    :param x_grid: numpy array of observation point eastings
+    :param y_grid: numpy array of observation point northings, same shape as x_grid
+    :param t: time since pumping began [s]
+    :param S: storativity of the aquifer [-]
+    :param T: transmissivity of the aquifer [m²/s]
+    :return: numpy array of summed drawdowns s [m], same shape as x_grid
+    '''
+    dtype = _float_dtype(x_grid)
+    s_total = np.zeros(np.shape(x_grid), dtype=dtype)
+
+    # Q/(4πT) is constant per well, reuse it if the wellfield already holds it for this T. Cast to the grid
+    # precision, a float64 scale would promote every wells float32 drawdown grid to a float64 temporary
+    if getattr(wellfield, "T", None) == T:
+        scales = np.asarray(wellfield.Q_over_4piT, dtype=dtype)
+    else:
+        scales = (np.asarray(wellfield.Qs)*(_INV_4PI/T)).astype(dtype)
+
+    # the well coordinates are cast as well, float64 coordinates would promote every per well temporary
+    xs = np.asarray(wellfield.xs, dtype=dtype)
+    ys = np.asarray(wellfield.ys, dtype=dtype)
+
+    for x, y, scale in zip(xs, ys, scales):
+        r = np.hypot(x_grid - x, y_grid - y)
+        u = theis_u_arr(r = r, S = S, T = T, t = t)
+        W_von_u = theis_wellfunction_arr(u = u, out = u)
+        W_von_u *= scale
+        s_total += W_von_u
 
-    return (Q/(4*math.pi*T))*W_von_u
+    return s_total
 
+@njit(cache=True, fastmath=True)
 def jakob_freegw_mod(s: float, H: float) -> float:
     '''
     Modify the drawdown caused by a pumping well calculated for a confined aquifer to represent
@@ -63,4 +292,4 @@ def jakob_freegw_mod(s: float, H: float) -> float:
     :param H: height of the groundwater surface measured from tha base of the aquifer/top of the aquitard [m]
     :return: drawdown [m] within an unconfined aquifer
     '''
-    return s - ((s**2)/(2*H))
\ No newline at end of file
+    return s - s*s*(0.5/H)
\ No newline at end of file
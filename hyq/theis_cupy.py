@@ -0,0 +1,32 @@
+import cupy
+
+from hyq.theis import _wellfunction_approx_source, _INV_4PI
+
+# One GPU thread per grid cell: Theis-Parameter, W(u) and drawdown fused into a single elementwise kernel.
+# W(u) = E1(u) uses the polynomial approximation Abramowitz & Stegun 5.1.53 for u < 1 and the rational
+# approximation 5.1.56 for u >= 1, both plain Horner chains generated from the coefficients in hyq.theis
+_theis_drawdown_kernel = cupy.ElementwiseKernel(
+    "F r, float64 t, float64 S, float64 trans, float64 Q",
+    "F s",
+    """
+    double rr = r > 0 ? (double)r : 0.01;
+    double u = rr*rr*S/(4.0*trans*t);
+    double W = u < 1.0 ? {0} : {1};
+    s = (F)(Q*{2!r}/trans*W);
+    """.format(*_wellfunction_approx_source("u"), _INV_4PI),
+    "hyq_theis_drawdown"
+)
+
+def theis_drawdown_cupy(r_arr: cupy.ndarray, t: float, S: float, T: float, Q: float) -> cupy.ndarray:
+    '''
+    Calculate the drawdown within a CONFINED aquifer for a whole (GPU resident) array of distances on a CUDA device.
+    Requires cupy and a CUDA capable GPU. float32 input stays float32 on output.
+
+    :param r_arr: cupy array of (observation) distances from pumping well in [m]
+    :param t: time since pumping began [s]
+    :param S: storativity of the aquifer [-]
+    :param T: transmissivity of the aquifer [m²/s]
+    :param Q: pumping rate of the well [m³/s]
+    :return: cupy array of drawdowns s [m], same shape and dtype as r_arr
+    '''
+    return _theis_drawdown_kernel(r_arr, float(t), float(S), float(T), float(Q))
@@ -0,0 +1,41 @@
+import functools
+
+from numba import vectorize, float32, float64, boolean
+
+from hyq.theis import theis_wellfunction, _INV_4PI
+
+def _theis_cell(u_prefactor, Q, T, t, confined, H0):
+    s = (Q*_INV_4PI/T)*theis_wellfunction(u_prefactor/t, 30)
+
+    if confined:
+        return s
+    return s - (s*s)/(2*H0)
+
+@functools.cache
+def _theis_cell_ufunc():
+    # a parallel ufunc needs explicit signatures and compiles them right away (which disk caching does not avoid),
+    # so it is built on first use instead of at import
+    return vectorize(
+        [
+            float32(float32, float32, float32, float32, boolean, float32),
+            float64(float64, float64, float64, float64, boolean, float64)
+        ],
+        target='parallel'
+    )(_theis_cell)
+
+def theis_cell(u_prefactor, Q, T, t, confined, H0, out=None):
+    '''
+    Fused drawdown kernel: Theis-Parameter, Theis-wellfunction, drawdown and (for unconfined aquifers)
+    the Jakob-correction for one grid cell, compiled to a parallel numpy ufunc so it can be broadcast
+    over whole grids. The ufunc is compiled on the first call.
+
+    :param u_prefactor: time independent part of the Theis-Parameter, r²·S/(4·T) [s]
+    :param Q: pumping rate of the well [m³/s]
+    :param T: transmissivity of the aquifer [m²/s]
+    :param t: time since pumping began [s]
+    :param confined: whether the aquifer is confined
+    :param H0: height of the groundwater surface measured from the base of the aquifer [m]
+    :param out: Optional numpy array to write the result into instead of allocating a new one
+    :return: drawdown s [m] for t at r
+    '''
+    return _theis_cell_ufunc()(u_prefactor, Q, T, t, confined, H0, out=out)
@@ -1,3 +1,9 @@
+import math
+from dataclasses import dataclass
+
+import numpy as np
+
+@dataclass(slots=True, frozen=True)
 class well:
     '''
     A class to represent a pumping well
@@ -13,9 +19,69 @@ class well:
     Q: float
         Pumping rate of the well [m³/s]
     '''
-    def __init__(self, ID, x, y, Q):
+    ID: str
+    x: float
+    y: float
+    Q: float
+
+class WellField:
+    '''
+    A class to represent a set of pumping wells as a structure of arrays, so calculations can work on all wells at once
+
+    Attributes
+    __________
+    IDs: list
+        The strings used to identify the wells
+    xs: numpy.ndarray
+        easting coordinates of the well positions in a cartesian grid
+    ys: numpy.ndarray
+        northing coordinates of the well positions in a cartesian grid
+    Qs: numpy.ndarray
+        Pumping rates of the wells [m³/s]
+    T: float
+        Transmissivity of the aquifer [m²/s] the wells pump from, None until set_transmissivity is called
+    Q_over_4piT: numpy.ndarray
+        Per well drawdown scaling factor Q/(4πT) of the Theis equation, None until set_transmissivity is called
+    '''
+    def __init__(self):
+
+        self.IDs = []
+        self.xs = np.empty(0)
+        self.ys = np.empty(0)
+        self.Qs = np.empty(0)
+        self.T = None
+        self.Q_over_4piT = None
+
+    @classmethod
+    def from_wells(cls, wells):
+        '''
+        Build a WellField from an iterable of well objects
+        '''
+        wellfield = cls()
+        wellfield.add(*wells)
+        return wellfield
+
+    def add(self, *wells):
+        '''
+        Append one or more well objects to the field
+        '''
+        self.IDs.extend(w.ID for w in wells)
+        self.xs = np.append(self.xs, [w.x for w in wells])
+        self.ys = np.append(self.ys, [w.y for w in wells])
+        self.Qs = np.append(self.Qs, [w.Q for w in wells])
+
+        if self.T is not None:
+            self.set_transmissivity(self.T)
+
+    def set_transmissivity(self, T):
+        '''
+        Set the aquifer transmissivity [m²/s] and precompute every wells scaling factor Q/(4πT) from it
+        '''
+        self.T = T
+        self.Q_over_4piT = self.Qs / (4*math.pi*T)
+
+    def __len__(self):
+        return len(self.IDs)
 
-        self.ID = ID
-        self.x = x
-        self.y = y
-        self.Q = Q
\ No newline at end of file
+    def __getitem__(self, k):
+        return well(ID=self.IDs[k], x=self.xs[k], y=self.ys[k], Q=self.Qs[k])
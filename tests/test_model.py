@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+from scipy.special import exp1
+
+import hyq.model_backend
+from hyq import GWModel, well
+
+H0, T, S, M = 10.0, 1e-3, 1e-4, 10.0
+TIMESTEPS = [60, 3600, 86400*10]
+WELLS = [well("A", 30.0, 70.0, 0.01), well("B", 62.5, 41.5, 0.02), well("C", 120.0, 20.0, 0.005)]
+
+@pytest.fixture(params=["numba", "numexpr", "scipy"])
+def backend(request, monkeypatch):
+    # the backend is picked by which optional dependency model_backend found, so the others are switched off
+    if request.param == "numba":
+        pytest.importorskip("numba")
+    else:
+        monkeypatch.setattr(hyq.model_backend, "theis_cell", None)
+    if request.param == "numexpr":
+        pytest.importorskip("numexpr")
+    elif request.param == "scipy":
+        monkeypatch.setattr(hyq.model_backend, "numexpr", None)
+    return request.param
+
+def build_model(dtype, confined, wells = WELLS, timesteps = TIMESTEPS):
+    model = GWModel(dtype = dtype)
+    model.set_grid(x_min = 0, y_max = 100, len_x = 100, len_y = 100, res_x = 1, res_y = 1)
+    model.set_aquiferparams(H0 = H0, T = T, S = S, M = M, confined = confined)
+    model.add_wells(*wells)
+    model.set_timesteps(timesteps)
+    return model
+
+def reference_heads(model, confined):
+    nrow, ncol = model.grid["arrayshape"]
+    X, Y = np.meshgrid(np.arange(ncol, dtype=np.float64), 100 - np.arange(nrow, dtype=np.float64))
+
+    heads = []
+    for t in model.timesteps:
+        H = np.full((nrow, ncol), H0)
+        for w in WELLS:
+            r = np.hypot(X - w.x, Y - w.y)
+            r = np.where(r > 0, r, 0.01)
+            s = w.Q/(4*np.pi*T)*exp1(r*r*S/(4*T*t))
+            if not confined:
+                s = s - s*s/(2*H0)
+            H -= s
+        heads.append(H)
+    return heads
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+@pytest.mark.parametrize("confined", [True, False])
+def test_run_matches_exp1(backend, dtype, confined):
+    model = build_model(dtype, confined)
+    model.run()
+
+    assert len(model.H) == len(TIMESTEPS)
+    for H, H_ref in zip(model.H, reference_heads(model, confined)):
+        assert H.dtype == dtype
+        np.testing.assert_allclose(H, H_ref, rtol=0, atol=1e-5)
+
+def test_run_without_wells(backend):
+    model = build_model(np.float32, True, wells = [])
+    model.run()
+
+    for H in model.H:
+        np.testing.assert_array_equal(H, H0)
+
+def test_run_without_timesteps(backend):
+    model = build_model(np.float32, True, timesteps = [])
+    model.run()
+
+    assert model.H == []
+    assert model.drawdown is None
+
+def test_well_results_by_id():
+    model = build_model(np.float64, True)
+    model.run()
+
+    np.testing.assert_allclose(model.well_distance("B")[58, 62], np.hypot(0.5, 0.5))
+    np.testing.assert_array_equal(model.well_drawdown("B"), model.drawdown[1])
+    with pytest.raises(KeyError):
+        model.well_drawdown("D")
+
+def test_well_drawdown_before_run():
+    model = build_model(np.float64, True)
+
+    with pytest.raises(ValueError):
+        model.well_drawdown("A")
+
+def test_run_with_array_timesteps(backend):
+    model = build_model(np.float32, True, timesteps = np.array(TIMESTEPS))
+    model.run()
+
+    assert len(model.H) == len(TIMESTEPS)
+    assert model.drawdown.base is None
+
+@pytest.mark.parametrize("timesteps", [[0, 60], [60, -1], np.array([0.0, 3600.0])])
+def test_non_positive_timesteps_raise(timesteps):
+    model = build_model(np.float32, True)
+
+    with pytest.raises(ValueError):
+        model.set_timesteps(timesteps)
+
+def test_parallel_run_matches_serial():
+    pytest.importorskip("joblib")
+    model = build_model(np.float32, False, timesteps = np.logspace(1, 6, 7))
+    model.run()
+    H_serial = model.H
+
+    model.H = []
+    model.run(n_jobs = 2)
+
+    assert len(model.H) == len(H_serial)
+    for H, H_ref in zip(model.H, H_serial):
+        np.testing.assert_array_equal(H, H_ref)
+    with pytest.raises(ValueError):
+        model.well_drawdown("A")
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+from scipy.special import exp1
+
+import hyq.theis
+from hyq.theis import theis_drawdown_arr, theis_drawdown_unconfined_arr, drawdown_superpose
+from hyq.wells import well, WellField
+
+Q, T, S, t, H = 0.01, 1e-3, 1e-4, 3600.0, 10.0
+
+@pytest.fixture(params=["numexpr", "numpy"])
+def backend(request, monkeypatch):
+    if request.param == "numexpr":
+        pytest.importorskip("numexpr")
+    else:
+        monkeypatch.setattr(hyq.theis, "numexpr", None)
+    return request.param
+
+def reference_drawdown(r):
+    r = np.where(np.asarray(r, dtype=np.float64) > 0, r, 0.01)
+    return Q/(4*np.pi*T)*exp1(r*r*S/(4*T*t))
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+def test_drawdown_arr_keeps_precision(backend, dtype):
+    r = np.array([0.0, 5.0, 10.0, 100.0], dtype=dtype)
+
+    s = theis_drawdown_arr(Q = Q, T = T, r = r, S = S, t = t)
+    assert s.dtype == dtype
+    np.testing.assert_allclose(s, reference_drawdown(r), rtol=1e-5)
+
+    s_unconfined = theis_drawdown_unconfined_arr(Q = Q, T = T, r = r, S = S, t = t, H = H)
+    assert s_unconfined.dtype == dtype
+    s_ref = reference_drawdown(r)
+    np.testing.assert_allclose(s_unconfined, s_ref - s_ref**2/(2*H), rtol=1e-5)
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+@pytest.mark.parametrize("with_transmissivity", [True, False])
+def test_drawdown_superpose(backend, dtype, with_transmissivity, monkeypatch):
+    wellfield = WellField.from_wells([well("a", 0.0, 0.0, Q), well("b", 30.0, 40.0, 2*Q)])
+    if with_transmissivity:
+        wellfield.set_transmissivity(T)
+    x_grid, y_grid = np.meshgrid(np.arange(0, 50, 5, dtype=dtype), np.arange(0, 60, 5, dtype=dtype))
+
+    # every per well intermediate has to stay in the grid precision, not only the summed result
+    seen_dtypes = set()
+    def spy(func):
+        def wrapper(*args, **kwargs):
+            seen_dtypes.update(np.asarray(a).dtype for a in (*args, *kwargs.values()) if isinstance(a, np.ndarray))
+            result = func(*args, **kwargs)
+            seen_dtypes.add(result.dtype)
+            return result
+        return wrapper
+    monkeypatch.setattr(hyq.theis, "theis_u_arr", spy(hyq.theis.theis_u_arr))
+    monkeypatch.setattr(hyq.theis, "theis_wellfunction_arr", spy(hyq.theis.theis_wellfunction_arr))
+
+    s = drawdown_superpose(wellfield, x_grid, y_grid, t = t, S = S, T = T)
+    assert s.dtype == dtype
+    assert seen_dtypes == {np.dtype(dtype)}
+
+    s_ref = sum(
+        Qw/Q*reference_drawdown(np.hypot(x_grid - x, y_grid - y))
+        for x, y, Qw in zip(wellfield.xs, wellfield.ys, wellfield.Qs)
+    )
+    np.testing.assert_allclose(s, s_ref, rtol=1e-5)
+
+@pytest.mark.parametrize("r", [5.0, np.array(5.0), [5.0, 10.0]])
+def test_drawdown_arr_accepts_array_likes(backend, r):
+    s = theis_drawdown_arr(Q = Q, T = T, r = r, S = S, t = t)
+
+    assert isinstance(s, np.ndarray)
+    np.testing.assert_allclose(s, reference_drawdown(r), rtol=1e-12)
+
+def test_wellfunction_approx_source():
+    # the string backends (numexpr, CUDA) compile W(u) from this source, evaluated here with numpy instead
+    u = np.concatenate([np.logspace(-8, -0.01, 50), np.logspace(0, 2, 50)])
+    small, large = hyq.theis._wellfunction_approx_source("u")
+    namespace = {"u": u, "log": np.log, "exp": np.exp}
+
+    W = np.where(u < 1, eval(small, namespace), eval(large, namespace))
+    np.testing.assert_allclose(W, exp1(u), rtol=1e-6, atol=2e-7)
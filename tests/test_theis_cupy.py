@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+from scipy.special import exp1
+
+cupy = pytest.importorskip("cupy")
+
+try:
+    cupy.cuda.runtime.getDeviceCount()
+except cupy.cuda.runtime.CUDARuntimeError:
+    pytest.skip("no CUDA device available", allow_module_level=True)
+
+from hyq.theis_cupy import theis_drawdown_cupy
+
+Q, T, S, t = 0.01, 1e-3, 1e-4, 3600.0
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+def test_drawdown_cupy_matches_exp1(dtype):
+    # spans both branches of the kernels W(u), u < 1 and u >= 1, and the r = 0 clamp
+    r = np.array([0.0, 0.5, 5.0, 10.0, 30.0, 60.0, 100.0, 300.0], dtype=dtype)
+
+    s = theis_drawdown_cupy(cupy.asarray(r), t = t, S = S, T = T, Q = Q)
+    assert s.dtype == dtype
+
+    r_ref = np.where(r > 0, r, 0.01).astype(np.float64)
+    s_ref = Q/(4*np.pi*T)*exp1(r_ref*r_ref*S/(4*T*t))
+    np.testing.assert_allclose(cupy.asnumpy(s), s_ref, rtol=1e-6, atol=1e-9)